@@ -1,13 +1,40 @@
+import atexit
 import os
+import signal
+import sys
 
 from dotenv import load_dotenv
+
+# 環境変数を読み込む（設定を読むモジュールをimportする前に行う）
+load_dotenv()
+
 from flask import Flask, jsonify, render_template, request
 from flask_cors import CORS
 from routes.articles import articles_bp
 from routes.summarize import summarize_bp
+from services.cache import load_snapshot, save_snapshot, start_snapshot_writer
+from services.digest import start_digest_scheduler
+
+CACHE_SNAPSHOT_PATH = os.getenv('CACHE_SNAPSHOT_PATH', 'cache_snapshot.json')
+DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
 
-# 環境変数を読み込む
-load_dotenv()
+
+def start_background_tasks():
+    """キャッシュの復元・保存とダイジェストの事前計算を開始"""
+    # 前回のスナップショットから復元し、定期的および終了時に保存する
+    load_snapshot(CACHE_SNAPSHOT_PATH)
+    atexit.register(save_snapshot, CACHE_SNAPSHOT_PATH)
+    start_snapshot_writer(CACHE_SNAPSHOT_PATH, float(os.getenv('CACHE_SNAPSHOT_INTERVAL', 300)))
+
+    # プリセット分野のダイジェストを定期的に事前計算
+    if os.getenv('DIGEST_ENABLED', 'False').lower() == 'true':
+        start_digest_scheduler()
+
+
+# werkzeugのリローダーの親プロセスはリクエストを処理しないので何もしない
+# （古いキャッシュで子プロセスのスナップショットを上書きしないようにする）
+if not (__name__ == '__main__' and DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'):
+    start_background_tasks()
 
 app = Flask(__name__)
 CORS(app)
@@ -35,7 +62,9 @@ def health():
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
-    debug = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
     print(f'Starting Flask app on http://localhost:{port}')
     print(f'LLM Type: {os.getenv("LLM_TYPE", "dummy")}')
-    app.run(host='0.0.0.0', port=port, debug=debug)
+
+    # SIGTERMの既定の動作ではatexitが実行されないので、通常の終了に変換する
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    app.run(host='0.0.0.0', port=port, debug=DEBUG)
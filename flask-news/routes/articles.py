@@ -1,7 +1,11 @@
 from flask import Blueprint, jsonify, request
 from services.arxiv import fetch_arxiv_papers
+from services.cache import result_cache
+from services.deadline import deadline_from_request
+from services.digest import get_preset_digest
 from services.patents import fetch_patents
-from services.semantic_scholar import fetch_semantic_scholar_papers
+from services.related import get_related_index, index_records
+from services.semantic_scholar import enrich_arxiv_papers, fetch_semantic_scholar_papers
 
 articles_bp = Blueprint('articles', __name__)
 
@@ -10,27 +14,51 @@ articles_bp = Blueprint('articles', __name__)
 def get_articles():
     """論文を検索して取得"""
     try:
+        deadline = deadline_from_request(request)
         data = request.get_json()
         field = data.get('field', '')
         keywords = data.get('keywords', '')
 
         print(f'Searching for: field={field}, keywords={keywords}')
 
-        # arXiv APIから論文を取得
-        articles = fetch_arxiv_papers(field, keywords)
-
-        # arXivで取得できなかった場合はSemantic Scholarを試す
-        if not articles:
-            fallback_query = keywords or field or 'artificial intelligence'
-            articles = fetch_semantic_scholar_papers(fallback_query)
+        # キーワードなしのプリセット検索は事前計算したダイジェストから返す
+        if not keywords:
+            digest = get_preset_digest(field)
+            if digest is not None and digest['articles']:
+                return jsonify({
+                    'articles': digest['articles'],
+                    'digestVersion': digest['version'],
+                    'truncated': False
+                })
+
+        cache_key = f'articles:{field}:{keywords}'
+        articles = result_cache.get(cache_key)
+        if articles is None:
+            # arXiv APIから論文を取得
+            articles = fetch_arxiv_papers(field, keywords, deadline)
+
+            # Semantic Scholarの被引用数・掲載先・TLDRで補完
+            if articles:
+                articles = enrich_arxiv_papers(articles, deadline)
+
+            # arXivで取得できなかった場合はSemantic Scholarを試す
+            if not articles:
+                fallback_query = keywords or field or 'artificial intelligence'
+                articles = fetch_semantic_scholar_papers(fallback_query, deadline)
+
+            # 時間切れで打ち切った結果はキャッシュしない
+            if articles and not deadline.truncated:
+                result_cache.set(cache_key, articles)
+                index_records(articles)
 
         if not articles:
             return jsonify({
                 'articles': [],
-                'message': '検索結果が見つかりませんでした。別のキーワードで試してください。'
+                'message': '検索結果が見つかりませんでした。別のキーワードで試してください。',
+                'truncated': deadline.truncated
             })
 
-        return jsonify({'articles': articles})
+        return jsonify({'articles': articles, 'truncated': deadline.truncated})
 
     except Exception as e:
         print(f'Error fetching articles: {e}')
@@ -40,12 +68,37 @@ def get_articles():
         }), 500
 
 
+@articles_bp.route('/digest', methods=['POST'])
+def get_digest():
+    """プリセットのダイジェスト（論文・要約・関連記事）を取得"""
+    try:
+        data = request.get_json()
+        field = data.get('field', '')
+
+        digest = get_preset_digest(field)
+
+        if digest is None:
+            return jsonify({
+                'error': 'この分野のダイジェストはまだ作成されていません'
+            }), 404
+
+        return jsonify(digest)
+
+    except Exception as e:
+        print(f'Error fetching digest: {e}')
+        return jsonify({
+            'error': 'ダイジェストの取得に失敗しました',
+            'details': str(e)
+        }), 500
+
+
 @articles_bp.route('/web-articles', methods=['POST'])
 def get_web_articles():
     """ウェブ記事をRSSから取得"""
     try:
         from services.rss import fetch_multiple_rss_feeds
 
+        deadline = deadline_from_request(request)
         data = request.get_json()
         sources = data.get('sources', [])
 
@@ -55,15 +108,17 @@ def get_web_articles():
                 'message': 'ソースが指定されていません'
             })
 
-        articles = fetch_multiple_rss_feeds(sources)
+        articles = fetch_multiple_rss_feeds(sources, deadline)
+        index_records(articles)
 
         if not articles:
             return jsonify({
                 'articles': [],
-                'message': '記事が見つかりませんでした'
+                'message': '記事が見つかりませんでした',
+                'truncated': deadline.truncated
             })
 
-        return jsonify({'articles': articles})
+        return jsonify({'articles': articles, 'truncated': deadline.truncated})
 
     except Exception as e:
         print(f'Error fetching web articles: {e}')
@@ -77,6 +132,7 @@ def get_web_articles():
 def get_patents():
     """特許を検索して取得"""
     try:
+        deadline = deadline_from_request(request)
         data = request.get_json()
         query = data.get('query', '')
         limit = data.get('limit', 20)
@@ -90,15 +146,22 @@ def get_patents():
         print(f'Searching for patents: query={query}')
 
         # 特許を検索
-        patents = fetch_patents(query, limit)
+        cache_key = f'patents:{query}:{limit}'
+        patents = result_cache.get(cache_key)
+        if patents is None:
+            patents = fetch_patents(query, limit, deadline)
+            if patents and not deadline.truncated:
+                result_cache.set(cache_key, patents)
+                index_records(patents)
 
         if not patents:
             return jsonify({
                 'patents': [],
-                'message': '特許が見つかりませんでした。別のキーワードで試してください。'
+                'message': '特許が見つかりませんでした。別のキーワードで試してください。',
+                'truncated': deadline.truncated
             })
 
-        return jsonify({'patents': patents})
+        return jsonify({'patents': patents, 'truncated': deadline.truncated})
 
     except Exception as e:
         print(f'Error fetching patents: {e}')
@@ -106,3 +169,48 @@ def get_patents():
             'error': '特許の取得に失敗しました',
             'details': str(e)
         }), 500
+
+
+@articles_bp.route('/related', methods=['POST'])
+def get_related():
+    """取得済みの論文・記事から類似するものを検索"""
+    try:
+        data = request.get_json()
+        url = data.get('url', '')
+        title = data.get('title', '')
+        abstract = data.get('abstract', '')
+
+        try:
+            limit = max(1, min(int(data.get('limit', 10)), 50))
+        except (TypeError, ValueError):
+            return jsonify({
+                'error': 'limitは整数で指定してください'
+            }), 400
+
+        index = get_related_index()
+
+        # URLがインデックス済みならそのレコードを基準にする
+        record = index.get(url) if url else None
+        if record is None:
+            if not title and not abstract:
+                return jsonify({
+                    'error': 'URLまたはタイトル・概要が必要です'
+                }), 400
+            record = {'url': url, 'title': title, 'abstract': abstract}
+
+        related = index.related(record, limit)
+
+        if not related:
+            return jsonify({
+                'articles': [],
+                'message': '関連する論文・記事が見つかりませんでした'
+            })
+
+        return jsonify({'articles': related})
+
+    except Exception as e:
+        print(f'Error fetching related articles: {e}')
+        return jsonify({
+            'error': '関連論文の取得に失敗しました',
+            'details': str(e)
+        }), 500
@@ -1,5 +1,7 @@
 from flask import Blueprint, jsonify, request
-from services.llm import generate_summary
+from services.admission import BULK, INTERACTIVE, QueueFullError, get_summary_admission
+from services.deadline import deadline_from_request
+from services.llm import LLM_TIMEOUT, generate_summary
 
 summarize_bp = Blueprint('summarize', __name__)
 
@@ -8,18 +10,27 @@ summarize_bp = Blueprint('summarize', __name__)
 def summarize():
     """論文を要約"""
     try:
+        deadline = deadline_from_request(request, default=LLM_TIMEOUT)
         data = request.get_json()
         title = data.get('title', '')
         abstract = data.get('abstract', '')
+        priority = BULK if data.get('priority') == 'bulk' else INTERACTIVE
 
         if not title or not abstract:
             return jsonify({
                 'error': 'タイトルと概要が必要です'
             }), 400
 
-        summary = generate_summary(title, abstract)
+        summary = generate_summary(title, abstract, deadline, priority)
 
-        return jsonify({'summary': summary})
+        return jsonify({'summary': summary, 'truncated': deadline.truncated})
+
+    except QueueFullError as e:
+        print(f'Summary request rejected: {e}')
+        return jsonify({
+            'error': '要約リクエストが混雑しています。しばらくしてから再度お試しください',
+            'retryAfter': e.retry_after
+        }), 429, {'Retry-After': str(e.retry_after)}
 
     except Exception as e:
         print(f'Error generating summary: {e}')
@@ -27,3 +38,9 @@ def summarize():
             'error': '要約の生成に失敗しました',
             'details': str(e)
         }), 500
+
+
+@summarize_bp.route('/summarize/status', methods=['GET'])
+def summarize_status():
+    """要約の待ち行列の状態（同時実行数以外はこのワーカーの値）"""
+    return jsonify({'scope': 'worker', 'backends': get_summary_admission().stats()})
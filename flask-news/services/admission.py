@@ -0,0 +1,256 @@
+import fcntl
+import heapq
+import itertools
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+# 優先度（小さいほど優先）
+INTERACTIVE = 0
+BULK = 1
+
+# 待ち行列のうち一括処理が使える割合
+BULK_QUEUE_SHARE = 0.5
+
+# 同時実行数のうち対話的なリクエスト専用に確保する割合（全ワーカー共通）
+INTERACTIVE_RESERVED_SHARE = 0.25
+
+# 他ワーカーの実行枠が空くのを確認する間隔（秒）
+SLOT_POLL_INTERVAL = 0.05
+
+# 統計の指数移動平均の係数と、実績がないときの処理時間の見積もり（秒）
+EWMA_ALPHA = 0.2
+INITIAL_SERVICE_TIME = 5.0
+
+
+def concurrency_limits() -> Dict[str, int]:
+    """バックエンドごとの同時実行数（全ワーカー合計）"""
+    return {
+        'ollama': int(os.getenv('LLM_CONCURRENCY_OLLAMA', 2)),
+        'openai': int(os.getenv('LLM_CONCURRENCY_OPENAI', 8)),
+    }
+
+
+def max_queue_size() -> int:
+    """待ち行列の長さの上限（ワーカーごと）"""
+    return int(os.getenv('LLM_QUEUE_SIZE', 32))
+
+
+def reserved_slots(limit: int) -> int:
+    """対話的なリクエスト専用の実行枠の数（一括処理にも最低1枠は残す）"""
+    if limit <= 1:
+        return 0
+    return min(max(1, int(limit * INTERACTIVE_RESERVED_SHARE)), limit - 1)
+
+
+class QueueFullError(Exception):
+    """待ち行列が満杯で受け付けられない"""
+
+    def __init__(self, backend: str, retry_after: int):
+        super().__init__(f'{backend} queue is full, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class AdmissionTimeout(Exception):
+    """締め切りまでに実行枠を確保できなかった"""
+
+
+class BackendState:
+    """バックエンドごとの実行枠・待ち行列・統計"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.reserved = reserved_slots(limit)
+        self.active = 0
+        self.waiters: List[Tuple[int, int]] = []
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.service_time = INITIAL_SERVICE_TIME
+
+    def record_wait(self, seconds: float) -> None:
+        self.admitted += 1
+        self.wait_time += EWMA_ALPHA * (seconds - self.wait_time)
+        self.max_wait_time = max(self.max_wait_time, seconds)
+
+    def record_service(self, seconds: float) -> None:
+        self.service_time += EWMA_ALPHA * (seconds - self.service_time)
+
+    def slots_for(self, priority: int) -> int:
+        """優先度ごとに使える実行枠の数（一括処理は専用枠を使えない）"""
+        return self.limit if priority == INTERACTIVE else self.limit - self.reserved
+
+    def retry_after(self) -> int:
+        """待ち行列が捌けるまでの見積もり秒数"""
+        return max(1, math.ceil(self.service_time * (len(self.waiters) + 1) / self.limit))
+
+
+class ProcessSlots:
+    """
+    ファイルロックによるワーカー間で共有する実行枠
+
+    バックエンドごとにlimit個のロックファイルを用意し、いずれかをflockできた
+    プロセスだけが実行する。プロセスが落ちてもロックはOSが解放する。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, backend: str, limit: int, timeout: float) -> Optional[IO]:
+        """
+        先頭limit個のうち空いている枠を確保（timeout秒以内に確保できなければNone）
+
+        末尾の枠は対話的なリクエスト専用で、一括処理はlimitを小さくして呼び出す。
+        """
+        end = time.monotonic() + timeout
+        while True:
+            for slot in range(limit):
+                lock_file = open(os.path.join(self.directory, f'{backend}-{slot}.lock'), 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return lock_file
+                except BlockingIOError:
+                    lock_file.close()
+
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(SLOT_POLL_INTERVAL, remaining))
+
+    def release(self, lock_file: IO) -> None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+class AdmissionController:
+    """
+    LLM呼び出しのアドミッション制御
+
+    バックエンドごとに同時実行数を制限し、空きがなければ優先度順の待ち行列に並べる。
+    待ち行列が満杯なら即座にQueueFullErrorを送出する。一括処理は待ち行列の一部しか
+    使えないため、混雑時も対話的なリクエストの枠が残る。
+
+    同時実行数はProcessSlotsで全ワーカー合計に対して制限し、その一部は対話的な
+    リクエスト専用にする。ワーカーをまたいだ枠の取り合いには順序がないが、一括処理が
+    専用枠を使えないので、混雑時も対話的なリクエストは一括処理に押し出されない。
+    待ち行列と統計はワーカーごとなので、全体の待ち行列の上限はワーカー数 × max_queueになる。
+    """
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, max_queue: Optional[int] = None,
+                 bulk_queue_share: float = BULK_QUEUE_SHARE, slot_dir: Optional[str] = None):
+        self.limits = limits if limits is not None else concurrency_limits()
+        self.max_queue = max_queue if max_queue is not None else max_queue_size()
+        self.bulk_queue_share = bulk_queue_share
+        self.slots = ProcessSlots(slot_dir or os.getenv(
+            'LLM_SLOT_DIR', os.path.join(tempfile.gettempdir(), 'news-llm-slots')
+        ))
+        self._states: Dict[str, BackendState] = {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+
+    def _state(self, backend: str) -> BackendState:
+        state = self._states.get(backend)
+        if state is None:
+            state = BackendState(self.limits.get(backend, 1))
+            self._states[backend] = state
+        return state
+
+    @contextmanager
+    def admit(self, backend: str, priority: int = INTERACTIVE,
+              timeout: float = 60) -> Iterator[None]:
+        """実行枠を確保してからブロックを実行"""
+        with self._cond:
+            state = self._state(backend)
+            enqueued = time.monotonic()
+
+            slots = state.slots_for(priority)
+            if state.active >= slots or state.waiters:
+                capacity = self.max_queue
+                if priority != INTERACTIVE:
+                    capacity = int(self.max_queue * self.bulk_queue_share)
+                if len(state.waiters) >= capacity:
+                    state.rejected += 1
+                    raise QueueFullError(backend, state.retry_after())
+
+                entry = (priority, next(self._seq))
+                heapq.heappush(state.waiters, entry)
+
+                # 先頭になり、かつ空きができるまで待つ
+                while state.waiters[0] != entry or state.active >= slots:
+                    remaining = enqueued + timeout - time.monotonic()
+                    if remaining <= 0:
+                        state.waiters.remove(entry)
+                        heapq.heapify(state.waiters)
+                        state.timed_out += 1
+                        self._cond.notify_all()
+                        raise AdmissionTimeout(f'Timed out waiting for {backend}')
+                    self._cond.wait(remaining)
+
+                heapq.heappop(state.waiters)
+
+            state.active += 1
+            # 空きが複数ある場合に次の待ち手も進めるようにする
+            self._cond.notify_all()
+
+        # 他のワーカーも含めた実行枠を確保する
+        remaining = max(enqueued + timeout - time.monotonic(), 0)
+        slot = self.slots.acquire(backend, slots, remaining)
+        if slot is None:
+            with self._cond:
+                state.active -= 1
+                state.timed_out += 1
+                self._cond.notify_all()
+            raise AdmissionTimeout(f'Timed out waiting for {backend} slot')
+
+        started = time.monotonic()
+        with self._cond:
+            state.record_wait(started - enqueued)
+
+        try:
+            yield
+        finally:
+            self.slots.release(slot)
+            with self._cond:
+                state.active -= 1
+                state.record_service(time.monotonic() - started)
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Dict]:
+        """バックエンドごとの待ち行列の長さ・待ち時間などの統計（このワーカーの分）"""
+        with self._cond:
+            return {
+                backend: {
+                    'limit': state.limit,
+                    'reservedForInteractive': state.reserved,
+                    'active': state.active,
+                    'queueDepth': len(state.waiters),
+                    'maxQueue': self.max_queue,
+                    'admitted': state.admitted,
+                    'rejected': state.rejected,
+                    'timedOut': state.timed_out,
+                    'avgWaitSeconds': round(state.wait_time, 3),
+                    'maxWaitSeconds': round(state.max_wait_time, 3),
+                    'avgServiceSeconds': round(state.service_time, 3),
+                }
+                for backend, state in self._states.items()
+            }
+
+
+_summary_admission: Optional[AdmissionController] = None
+_summary_admission_lock = threading.Lock()
+
+
+def get_summary_admission() -> AdmissionController:
+    """要約生成で共有するインスタンスを取得（初回アクセス時に設定を読む）"""
+    global _summary_admission
+    with _summary_admission_lock:
+        if _summary_admission is None:
+            _summary_admission = AdmissionController()
+        return _summary_admission
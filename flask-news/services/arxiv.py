@@ -1,35 +1,56 @@
-import time
 import xml.etree.ElementTree as ET
-from typing import Dict, List
-
-import requests
-
-
-def fetch_arxiv_papers(field: str, keywords: str) -> List[Dict]:
+from typing import Dict, List, Optional
+
+from services.deadline import Deadline, ensure_deadline
+from services.singleflight import normalize_query, upstream_flight
+
+# 技術分野のプリセット（日本語の分野名 → arXivの検索語）
+FIELD_MAP = {
+    '機械学習': 'machine learning',
+    '自然言語処理': 'natural language processing NLP',
+    'コンピュータビジョン': 'computer vision',
+    'データサイエンス': 'data science',
+    'Web開発': 'web development',
+    'モバイル開発': 'mobile development',
+    'クラウドコンピューティング': 'cloud computing',
+    'ブロックチェーン': 'blockchain',
+    'サイバーセキュリティ': 'cybersecurity security',
+    '量子コンピューティング': 'quantum computing',
+}
+
+
+def fetch_arxiv_papers(field: str, keywords: str,
+                       deadline: Optional[Deadline] = None) -> List[Dict]:
     """arXiv APIから論文を取得"""
+    deadline = ensure_deadline(deadline)
+
     # 検索クエリの構築
     search_queries = []
     if keywords:
         search_queries.append(keywords)
     if field:
         # 日本語の分野を英語に変換
-        field_map = {
-            '機械学習': 'machine learning',
-            '自然言語処理': 'natural language processing NLP',
-            'コンピュータビジョン': 'computer vision',
-            'データサイエンス': 'data science',
-            'Web開発': 'web development',
-            'モバイル開発': 'mobile development',
-            'クラウドコンピューティング': 'cloud computing',
-            'ブロックチェーン': 'blockchain',
-            'サイバーセキュリティ': 'cybersecurity security',
-            '量子コンピューティング': 'quantum computing',
-        }
-        search_queries.append(field_map.get(field, field))
+        search_queries.append(FIELD_MAP.get(field, field))
     else:
         search_queries.append('artificial intelligence')
     search_query = '+AND+'.join(search_queries)
 
+    # 同じクエリの同時リクエストは1回のarXiv呼び出しにまとめる
+    return upstream_flight.do_with_deadline(
+        f'arxiv:{normalize_query(search_query)}',
+        fetch_arxiv_query,
+        search_query,
+        deadline=deadline,
+        default=[]
+    )
+
+
+def fetch_arxiv_query(search_query: str, deadline: Optional[Deadline] = None) -> List[Dict]:
+    """構築済みの検索クエリでarXiv APIを呼び出す"""
+    import requests
+
+    deadline = ensure_deadline(deadline)
+
     # arXiv API URL（複数のエンドポイントを試す）
     urls = [
         f'http://export.arxiv.org/api/query?search_query=all:{search_query}&start=0&max_results=20&sortBy=submittedDate&sortOrder=descending',
@@ -41,13 +62,18 @@ def fetch_arxiv_papers(field: str, keywords: str) -> List[Dict]:
 
     for url in urls:
         for attempt in range(max_retries):
+            # 締め切りまでに次の試行を行う余裕がなければ打ち切る
+            if not deadline.check():
+                print('Deadline exceeded, giving up on arXiv')
+                return articles
+
             try:
                 print(f'Fetching from arXiv (attempt {attempt + 1}/{max_retries}): {url}')
 
                 response = requests.get(
                     url,
                     headers={'User-Agent': 'NewsAggregator/1.0'},
-                    timeout=10
+                    timeout=deadline.timeout(10)
                 )
 
                 if response.status_code == 200:
@@ -59,16 +85,19 @@ def fetch_arxiv_papers(field: str, keywords: str) -> List[Dict]:
                 if response.status_code == 503:
                     delay = 0.8 * (attempt + 1)
                     print(f'arXiv returned 503. Retrying after {delay}s...')
-                    time.sleep(delay)
+                    deadline.sleep(delay)
                     continue
 
             except Exception as e:
                 print(f'Failed with {url}: {e}')
-                time.sleep(0.8 * (attempt + 1))
+                deadline.sleep(0.8 * (attempt + 1))
 
         if articles:
             break
 
+    if not articles and deadline.expired():
+        deadline.mark_truncated()
+
     return articles
 
 
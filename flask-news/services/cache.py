@@ -0,0 +1,157 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class TTLCache:
+    """有効期限と最大件数（LRUで追い出し）を持つインメモリキャッシュ"""
+
+    def __init__(self, name: str, ttl: float, max_entries: int):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self) -> None:
+        """上限を超えていれば期限切れを削除し、それでも多ければ古い順に削除"""
+        if len(self._entries) <= self.max_entries:
+            return
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if e['expires'] < now]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        """キャッシュから値を取得（期限切れの場合はNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry['value']
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """キャッシュに値を保存"""
+        expires = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._entries[key] = {'value': value, 'expires': expires}
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def dump(self, merge_with: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        期限内のエントリをスナップショット用に書き出す
+
+        merge_with（他ワーカーが保存したエントリ）があれば、期限の遅い方を残してマージし、
+        最大件数を超えた分は期限の早いものから捨てる。
+        """
+        now = time.time()
+        entries = {k: e for k, e in (merge_with or {}).items() if e.get('expires', 0) >= now}
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry['expires'] >= now and entry['expires'] >= entries.get(key, {}).get('expires', 0):
+                    entries[key] = entry
+
+        if len(entries) > self.max_entries:
+            keep = sorted(entries, key=lambda k: entries[k]['expires'], reverse=True)[:self.max_entries]
+            entries = {k: entries[k] for k in keep}
+        return entries
+
+    def load(self, entries: Dict[str, Dict[str, Any]]) -> int:
+        """スナップショットのエントリを読み込む（期限切れは捨てる）"""
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, entry in entries.items():
+                if entry.get('expires', 0) >= now:
+                    self._entries[key] = entry
+                    loaded += 1
+            self._evict()
+        return loaded
+
+
+# 検索結果・要約・RSSフィード・論文メタデータのキャッシュ
+result_cache = TTLCache('results', ttl=600, max_entries=1000)
+summary_cache = TTLCache('summaries', ttl=60 * 60 * 24, max_entries=5000)
+feed_cache = TTLCache('feeds', ttl=600, max_entries=500)
+enrichment_cache = TTLCache('enrichment', ttl=60 * 60 * 24 * 7, max_entries=20000)
+
+CACHES = [result_cache, summary_cache, feed_cache, enrichment_cache]
+
+
+def read_snapshot(path: str) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """スナップショットファイルを読み込む（存在しない・壊れている場合は空）"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f'Error reading cache snapshot: {e}')
+        return {}
+
+
+def save_snapshot(path: str) -> None:
+    """
+    全キャッシュをJSONファイルに保存
+
+    複数ワーカーが同じファイルに保存するので、ファイルロックを取ってから
+    既存のスナップショットとマージして書き換える。
+    """
+    try:
+        with open(f'{path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                existing = read_snapshot(path)
+                snapshot = {cache.name: cache.dump(existing.get(cache.name)) for cache in CACHES}
+                # 書き込み途中のファイルを読ませないようにプロセスごとの一時ファイルから置き換える
+                directory = os.path.dirname(os.path.abspath(path))
+                with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory,
+                                                 prefix='.cache_snapshot-', delete=False) as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                os.replace(f.name, path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        print(f'Saved cache snapshot to {path}')
+    except Exception as e:
+        print(f'Error saving cache snapshot: {e}')
+
+
+def start_snapshot_writer(path: str, interval: float) -> None:
+    """
+    キャッシュを定期的にスナップショットへ保存するバックグラウンドスレッドを開始
+
+    SIGTERMなどでatexitが実行されずに終了しても、直近の保存分は残る。
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            save_snapshot(path)
+
+    threading.Thread(target=run, name='cache-snapshot', daemon=True).start()
+
+
+def load_snapshot(path: str) -> None:
+    """JSONファイルからキャッシュを復元"""
+    if not os.path.exists(path):
+        return
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+
+        for cache in CACHES:
+            loaded = cache.load(snapshot.get(cache.name, {}))
+            print(f'Loaded {loaded} entries into {cache.name} cache')
+    except Exception as e:
+        print(f'Error loading cache snapshot: {e}')
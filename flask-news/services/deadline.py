@@ -0,0 +1,95 @@
+import math
+import os
+import time
+from typing import Optional
+
+# 残り時間がこれを下回ったら新しい上流呼び出しを始めない
+MIN_CALL_TIME = 0.2
+
+
+class Deadline:
+    """
+    リクエスト単位の締め切り
+
+    ルートで生成してサービスに引き渡し、各上流呼び出しのタイムアウト・
+    リトライ・フォールバックはこの残り時間の範囲内で行う。
+    時間切れで処理を打ち切った場合はtruncatedを立てる。
+    """
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+        self.truncated = False
+
+    @classmethod
+    def after(cls, seconds: float) -> 'Deadline':
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        """新しい上流呼び出しを始める余裕がなければTrue"""
+        return self.remaining() < MIN_CALL_TIME
+
+    def timeout(self, cap: float) -> float:
+        """上流呼び出しのタイムアウト（サービス側の上限と残り時間の小さい方）"""
+        return max(min(cap, self.remaining()), 0.01)
+
+    def sleep(self, delay: float) -> None:
+        """締め切りを超えない範囲で待機"""
+        time.sleep(min(delay, self.remaining()))
+
+    def cancel(self) -> None:
+        """締め切りを即座に切れた状態にする（以降の上流呼び出しを打ち切らせる）"""
+        self.expires_at = time.monotonic()
+
+    def mark_truncated(self) -> None:
+        self.truncated = True
+
+    def check(self) -> bool:
+        """時間切れならtruncatedを立ててFalseを返す（続行可能ならTrue）"""
+        if self.expired():
+            self.truncated = True
+            return False
+        return True
+
+
+def default_timeout() -> float:
+    """リクエスト全体の既定の制限時間（秒）"""
+    return float(os.getenv('REQUEST_TIMEOUT', 20))
+
+
+def max_timeout() -> float:
+    """リクエスト全体の制限時間の上限（秒）"""
+    return float(os.getenv('REQUEST_TIMEOUT_MAX', 60))
+
+
+def ensure_deadline(deadline: Optional[Deadline]) -> Deadline:
+    """締め切りが渡されなければ既定の締め切りを生成"""
+    return deadline if deadline is not None else Deadline.after(default_timeout())
+
+
+def deadline_from_request(req, default: Optional[float] = None) -> Deadline:
+    """
+    リクエストから締め切りを生成
+
+    X-Request-Timeoutヘッダー、またはJSONボディのtimeout（秒）で指定でき、
+    指定がなければdefault（省略時はREQUEST_TIMEOUT）、上限はREQUEST_TIMEOUT_MAX
+    """
+    if default is None:
+        default = default_timeout()
+
+    value = req.headers.get('X-Request-Timeout')
+    if value is None:
+        data = req.get_json(silent=True) or {}
+        value = data.get('timeout')
+
+    try:
+        seconds = float(value) if value is not None else default
+    except (TypeError, ValueError):
+        seconds = default
+
+    # nanやinfを許すと上限を迂回できるので有限の正の値だけを受け付ける
+    if not math.isfinite(seconds) or seconds <= 0:
+        seconds = default
+    return Deadline.after(min(seconds, max_timeout()))
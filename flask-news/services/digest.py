@@ -0,0 +1,293 @@
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from services.admission import BULK, QueueFullError
+from services.arxiv import FIELD_MAP, fetch_arxiv_papers
+from services.deadline import Deadline
+from services.llm import generate_dummy_summary, generate_summary
+from services.related import rank_records
+from services.rss import fetch_multiple_rss_feeds
+from services.semantic_scholar import enrich_arxiv_papers
+
+
+# 1プリセットの再計算にかける時間の上限（秒）
+DIGEST_BUILD_TIMEOUT = 300
+
+# プリセットごとに残すスナップショットの世代数
+DIGEST_KEEP_VERSIONS = 5
+
+MAX_PAPERS = 20
+MAX_WEB_ARTICLES = 10
+
+# 関連記事の収集に使うRSSフィード（フロントエンドの既定ソースと同じ）
+DEFAULT_RSS_SOURCES = [
+    {'name': 'TechCrunch', 'rssUrl': 'https://techcrunch.com/feed/', 'category': 'スタートアップ'},
+    {'name': 'Hacker News', 'rssUrl': 'https://hnrss.org/frontpage', 'category': 'テックニュース'},
+    {'name': 'DEV Community', 'rssUrl': 'https://dev.to/feed', 'category': '開発'},
+    {'name': 'Qiita', 'rssUrl': 'https://qiita.com/popular-items/feed', 'category': '日本語'},
+]
+
+
+def digest_interval() -> float:
+    """再計算の間隔（秒）"""
+    return float(os.getenv('DIGEST_INTERVAL', 1800))
+
+
+def digest_max_age() -> float:
+    """スナップショットを配信に使う最大経過時間（秒）"""
+    return digest_interval() * 3
+
+
+def preset_slug(field: str) -> str:
+    """プリセットのディレクトリ名（英語の検索語から生成）"""
+    return re.sub(r'[^a-z0-9]+', '-', FIELD_MAP[field].lower()).strip('-')
+
+
+class DigestStore:
+    """
+    プリセットごとのダイジェストをバージョン付きのJSONファイルとして保存
+
+    <directory>/<slug>/<version>.json の形式で書き出し、最新バージョンを配信する。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._cache: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _versions(self, slug: str) -> List[int]:
+        path = os.path.join(self.directory, slug)
+        if not os.path.isdir(path):
+            return []
+        return sorted(
+            int(name[:-5]) for name in os.listdir(path)
+            if name.endswith('.json') and name[:-5].isdigit()
+        )
+
+    def latest(self, field: str) -> Optional[Dict]:
+        """最新のスナップショットを取得"""
+        slug = preset_slug(field)
+        versions = self._versions(slug)
+        if not versions:
+            return None
+
+        version = versions[-1]
+        with self._lock:
+            cached = self._cache.get(slug)
+            if cached is not None and cached['version'] == version:
+                return cached
+
+        try:
+            with open(os.path.join(self.directory, slug, f'{version}.json'), encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            print(f'Error loading digest {slug} v{version}: {e}')
+            return None
+
+        with self._lock:
+            self._cache[slug] = snapshot
+        return snapshot
+
+    def age(self, field: str) -> Optional[float]:
+        """最新のスナップショットを最後に作成・確認してからの経過秒数"""
+        slug = preset_slug(field)
+        versions = self._versions(slug)
+        if not versions:
+            return None
+        path = os.path.join(self.directory, slug, f'{versions[-1]}.json')
+        return time.time() - os.path.getmtime(path)
+
+    def touch(self, field: str) -> None:
+        """内容に変化がなかった場合に最新のスナップショットを確認済みにする"""
+        slug = preset_slug(field)
+        versions = self._versions(slug)
+        if versions:
+            os.utime(os.path.join(self.directory, slug, f'{versions[-1]}.json'))
+
+    def save(self, field: str, snapshot: Dict) -> int:
+        """新しいバージョンとして保存し、古いバージョンを削除"""
+        slug = preset_slug(field)
+        path = os.path.join(self.directory, slug)
+        os.makedirs(path, exist_ok=True)
+
+        versions = self._versions(slug)
+        version = versions[-1] + 1 if versions else 1
+        snapshot = {**snapshot, 'version': version}
+
+        tmp_path = os.path.join(path, f'{version}.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(path, f'{version}.json'))
+
+        for old in versions[:max(len(versions) - DIGEST_KEEP_VERSIONS + 1, 0)]:
+            try:
+                os.remove(os.path.join(path, f'{old}.json'))
+            except OSError:
+                pass
+
+        return version
+
+
+def build_digest(field: str, previous: Optional[Dict], web_articles: List[Dict],
+                 deadline: Deadline) -> Optional[Dict]:
+    """
+    プリセットのダイジェストを作成
+
+    前回のスナップショットにない論文（または要約が未作成の論文）だけを
+    補完・要約し、前回分とマージする。変化がなければ前回のスナップショットを、
+    論文を取得できなければNoneを返す。
+    """
+    previous_papers = {p['id']: p for p in (previous or {}).get('articles', [])}
+
+    papers = fetch_arxiv_papers(field, '', deadline)
+    if not papers:
+        print(f'No papers fetched for digest {field}')
+        return None
+
+    new_papers = [
+        p for p in papers
+        if p['id'] not in previous_papers or not previous_papers[p['id']].get('summary')
+    ]
+    print(f'Digest {field}: {len(new_papers)} new papers')
+
+    summarized = {}
+    for paper in enrich_arxiv_papers(new_papers, deadline):
+        # LLMが混雑していれば要約は次回に回す（対話的なリクエストを優先）
+        try:
+            summary = generate_summary(paper['title'], paper['abstract'], deadline, BULK)
+        except QueueFullError:
+            summary = None
+        # 要約に失敗した論文は次回に再試行する
+        if summary and summary != generate_dummy_summary(paper['title'], paper['abstract']):
+            paper = {**paper, 'summary': summary}
+        summarized[paper['id']] = paper
+
+    merged = {**previous_papers, **summarized}
+    articles = sorted(merged.values(), key=lambda p: p.get('publishedDate', ''), reverse=True)[:MAX_PAPERS]
+
+    query = ' '.join([FIELD_MAP[field]] + [p['title'] for p in articles])
+    related = rank_records(query, web_articles, MAX_WEB_ARTICLES)
+
+    if previous and articles == previous.get('articles') and related == previous.get('webArticles'):
+        return previous
+
+    return {
+        'field': field,
+        'createdAt': datetime.now(timezone.utc).isoformat(),
+        'articles': articles,
+        'webArticles': related,
+    }
+
+
+class DigestScheduler:
+    """
+    プリセットのダイジェストを定期的に再計算するバックグラウンドスレッド
+
+    複数ワーカーで起動しても、ファイルロックを取れた1プロセスだけが再計算する。
+    """
+
+    def __init__(self, store: DigestStore, interval: Optional[float] = None):
+        self.store = store
+        self.interval = interval if interval is not None else digest_interval()
+        self.lock_path = os.path.join(store.directory, '.lock')
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='digest-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh_all()
+            except Exception as e:
+                print(f'Error refreshing digests: {e}')
+            self._stop.wait(self.interval)
+
+    def _is_fresh(self, field: str) -> bool:
+        age = self.store.age(field)
+        return age is not None and age < self.interval * 0.9
+
+    def refresh_all(self) -> None:
+        """全プリセットのダイジェストを再計算（他プロセスが実行中なら何もしない）"""
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+
+            try:
+                stale = [f for f in FIELD_MAP if not self._is_fresh(f)]
+                if not stale:
+                    return
+
+                started = time.monotonic()
+                sources = [{**s, 'enabled': True} for s in DEFAULT_RSS_SOURCES]
+                web_articles = fetch_multiple_rss_feeds(sources, Deadline.after(60))
+
+                for field in stale:
+                    if self._stop.is_set():
+                        break
+                    try:
+                        previous = self.store.latest(field)
+                        snapshot = build_digest(
+                            field, previous, web_articles, Deadline.after(DIGEST_BUILD_TIMEOUT)
+                        )
+                        if snapshot is None:
+                            continue
+                        if snapshot is previous:
+                            self.store.touch(field)
+                            continue
+                        version = self.store.save(field, snapshot)
+                        print(f'Saved digest {field} v{version}')
+                    except Exception as e:
+                        print(f'Error building digest {field}: {e}')
+
+                print(f'Refreshed digests in {time.monotonic() - started:.1f}s')
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_store: Optional[DigestStore] = None
+_scheduler: Optional[DigestScheduler] = None
+
+
+def get_digest_store() -> DigestStore:
+    """共有のダイジェストストアを取得"""
+    global _store
+    if _store is None:
+        _store = DigestStore(os.getenv('DIGEST_DIR', 'digests'))
+    return _store
+
+
+def start_digest_scheduler() -> None:
+    """ダイジェストの定期再計算を開始"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = DigestScheduler(get_digest_store())
+        _scheduler.start()
+
+
+def get_preset_digest(field: str) -> Optional[Dict]:
+    """プリセットの配信可能なダイジェストを取得（古すぎる場合はNone）"""
+    if field not in FIELD_MAP:
+        return None
+
+    store = get_digest_store()
+    age = store.age(field)
+    if age is None or age > digest_max_age():
+        return None
+    return store.latest(field)
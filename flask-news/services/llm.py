@@ -1,24 +1,69 @@
+import hashlib
 import os
+from typing import Optional
 
-from openai import OpenAI
+from services.admission import INTERACTIVE, AdmissionTimeout, get_summary_admission
+from services.cache import summary_cache
+from services.deadline import Deadline, ensure_deadline
 
+# LLM呼び出し1回あたりのタイムアウト上限（秒）
+LLM_TIMEOUT = 60
 
-def generate_summary(title: str, abstract: str) -> str:
-    """論文の要約を生成"""
+
+def generate_summary(title: str, abstract: str, deadline: Optional[Deadline] = None,
+                     priority: int = INTERACTIVE) -> str:
+    """
+    論文の要約を生成（締め切りに間に合わなければダミー要約）
+
+    LLM呼び出しはアドミッション制御を通し、待ち行列が満杯ならQueueFullErrorを送出する
+    """
+    deadline = ensure_deadline(deadline)
     llm_type = os.getenv('LLM_TYPE', 'openai')
+    digest = hashlib.sha256(f'{title}\n{abstract}'.encode('utf-8')).hexdigest()
+    cache_key = f'{llm_type}:{digest}'
+
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     if llm_type == 'ollama':
-        return generate_summary_ollama(title, abstract)
+        generate = generate_summary_ollama
     elif llm_type == 'openai' and os.getenv('OPENAI_API_KEY'):
-        return generate_summary_openai(title, abstract)
+        generate = generate_summary_openai
     else:
         return generate_dummy_summary(title, abstract)
 
+    if not deadline.check():
+        print('Deadline exceeded, skipping LLM call')
+        return generate_dummy_summary(title, abstract)
+
+    try:
+        with get_summary_admission().admit(llm_type, priority, deadline.remaining()):
+            summary = generate(title, abstract, deadline)
+    except AdmissionTimeout:
+        print('Deadline exceeded while waiting for LLM')
+        deadline.mark_truncated()
+        return generate_dummy_summary(title, abstract)
+
+    # 失敗時のダミー要約はキャッシュしない
+    if summary != generate_dummy_summary(title, abstract):
+        summary_cache.set(cache_key, summary)
+    return summary
 
-def generate_summary_openai(title: str, abstract: str) -> str:
+
+def generate_summary_openai(title: str, abstract: str, deadline: Optional[Deadline] = None) -> str:
     """OpenAI APIで要約を生成"""
+    from openai import OpenAI
+
+    deadline = ensure_deadline(deadline)
+
     try:
-        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        # クライアント側のリトライは締め切りを超えうるので無効にする
+        client = OpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            timeout=deadline.timeout(LLM_TIMEOUT),
+            max_retries=0
+        )
 
         completion = client.chat.completions.create(
             model='gpt-4o-mini',
@@ -40,18 +85,25 @@ def generate_summary_openai(title: str, abstract: str) -> str:
 
     except Exception as e:
         print(f'OpenAI API error: {e}')
+        deadline.check()
         return generate_dummy_summary(title, abstract)
 
 
-def generate_summary_ollama(title: str, abstract: str) -> str:
+def generate_summary_ollama(title: str, abstract: str, deadline: Optional[Deadline] = None) -> str:
     """Ollamaで要約を生成"""
+    from openai import OpenAI
+
+    deadline = ensure_deadline(deadline)
+
     try:
         base_url = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
         model = os.getenv('OLLAMA_MODEL', 'llama3.2')
         print(model)
         client = OpenAI(
             base_url=base_url,
-            api_key='ollama'  # ダミーキー
+            api_key='ollama',  # ダミーキー
+            timeout=deadline.timeout(LLM_TIMEOUT),
+            max_retries=0
         )
         print(client.base_url)
 
@@ -76,6 +128,7 @@ def generate_summary_ollama(title: str, abstract: str) -> str:
 
     except Exception as e:
         print(f'Ollama error: {e}')
+        deadline.check()
         return generate_dummy_summary(title, abstract)
 
 
@@ -1,40 +1,50 @@
 import os
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-import requests
+from services.deadline import Deadline, ensure_deadline
+from services.singleflight import normalize_query, upstream_flight
 
 
-def fetch_patents(query: str, limit: int = 20) -> List[Dict]:
+def fetch_patents(query: str, limit: int = 20, deadline: Optional[Deadline] = None) -> List[Dict]:
     """
     Google PatenとUSPTO PatentsViewから特許を検索
 
     Args:
         query: 検索キーワード
         limit: 取得する特許数
+        deadline: リクエストの締め切り（時間切れならフォールバックを省略）
 
     Returns:
         特許情報のリスト
     """
+    deadline = ensure_deadline(deadline)
     patents = []
 
     # まずGoogle Patentsから検索を試みる
-    google_patents = fetch_google_patents(query, limit)
+    google_patents = fetch_google_patents(query, limit, deadline)
     patents.extend(google_patents)
 
     # 結果が少ない場合はPatentViewsも試す
-    if len(patents) < 5:
-        pv_patents = fetch_patentsview(query, limit - len(patents))
+    if len(patents) < 5 and deadline.check():
+        pv_patents = fetch_patentsview(query, limit - len(patents), deadline)
         patents.extend(pv_patents)
 
     return patents[:limit]
 
 
-def fetch_patentsview(query: str, limit: int = 20) -> List[Dict]:
+def fetch_patentsview(query: str, limit: int = 20,
+                      deadline: Optional[Deadline] = None) -> List[Dict]:
     """
     USPTO PatentViews APIから特許を取得
     https://patentsview.org/apis/api-endpoints
     """
+    import requests
+
+    deadline = ensure_deadline(deadline)
+    if not deadline.check():
+        return []
+
     try:
         url = "https://api.patentsview.org/patents/query"
 
@@ -66,7 +76,7 @@ def fetch_patentsview(query: str, limit: int = 20) -> List[Dict]:
             url,
             json=params,
             headers={'Content-Type': 'application/json'},
-            timeout=10
+            timeout=deadline.timeout(10)
         )
         print(response)
 
@@ -111,33 +121,51 @@ def fetch_patentsview(query: str, limit: int = 20) -> List[Dict]:
 
     except requests.exceptions.Timeout:
         print('PatentsView API timeout')
+        deadline.check()
         return []
     except Exception as e:
         print(f'PatentsView error: {e}')
+        deadline.check()
         return []
 
 
-def fetch_google_patents(query: str, limit: int = 10) -> List[Dict]:
+def fetch_google_patents(query: str, limit: int = 10,
+                         deadline: Optional[Deadline] = None) -> List[Dict]:
     """
     Google Patentsから特許を検索
     1. SerpApiを使用（APIキーがある場合）
     2. フォールバック: Google Custom Search API
     3. フォールバック: 直接スクレイピング
     """
+    deadline = ensure_deadline(deadline)
     serpapi_key = os.getenv('SERPAPI_KEY')
 
     if serpapi_key:
-        return fetch_google_patents_serpapi(query, limit, serpapi_key)
+        # 同じクエリの同時リクエストは1回のSerpApi呼び出しにまとめる
+        return upstream_flight.do_with_deadline(
+            f'serpapi:{normalize_query(query)}:{limit}',
+            fetch_google_patents_serpapi,
+            query, limit, serpapi_key,
+            deadline=deadline,
+            default=[]
+        )
     else:
         print('SerpApi key not found, using direct search')
-        return fetch_google_patents_direct(query, limit)
+        return fetch_google_patents_direct(query, limit, deadline)
 
 
-def fetch_google_patents_serpapi(query: str, limit: int, api_key: str) -> List[Dict]:
+def fetch_google_patents_serpapi(query: str, limit: int, api_key: str,
+                                 deadline: Optional[Deadline] = None) -> List[Dict]:
     """
     SerpApiを使用してGoogle Patentsを検索
     https://serpapi.com/google-patents-api
     """
+    import requests
+
+    deadline = ensure_deadline(deadline)
+    if not deadline.check():
+        return []
+
     try:
         url = "https://serpapi.com/search"
 
@@ -150,7 +178,7 @@ def fetch_google_patents_serpapi(query: str, limit: int, api_key: str) -> List[D
 
         print(f'Searching Google Patents via SerpApi for: {query}')
 
-        response = requests.get(url, params=params, timeout=15)
+        response = requests.get(url, params=params, timeout=deadline.timeout(15))
 
         if response.status_code != 200:
             print(f'SerpApi error: {response.status_code}')
@@ -201,14 +229,22 @@ def fetch_google_patents_serpapi(query: str, limit: int, api_key: str) -> List[D
 
     except Exception as e:
         print(f'SerpApi error: {e}')
+        deadline.check()
         return []
 
 
-def fetch_google_patents_direct(query: str, limit: int) -> List[Dict]:
+def fetch_google_patents_direct(query: str, limit: int,
+                                deadline: Optional[Deadline] = None) -> List[Dict]:
     """
     Google Patentsを直接検索（簡易実装）
     スクレイピングではなく、公開APIエンドポイントを使用
     """
+    import requests
+
+    deadline = ensure_deadline(deadline)
+    if not deadline.check():
+        return []
+
     try:
         # Google Patents Public Dataを使用（制限あり）
         # 注: これはデモ版で、実際にはSerpApiを推奨
@@ -224,7 +260,7 @@ def fetch_google_patents_direct(query: str, limit: int) -> List[Dict]:
             'rows': min(limit, 25)
         }
 
-        response = requests.get(url, params=params, timeout=10)
+        response = requests.get(url, params=params, timeout=deadline.timeout(10))
 
         if response.status_code == 200:
             data = response.json()
@@ -252,6 +288,7 @@ def fetch_google_patents_direct(query: str, limit: int) -> List[Dict]:
 
     except Exception as e:
         print(f'Direct search error: {e}')
+        deadline.check()
         return []
 
 
@@ -0,0 +1,336 @@
+import fcntl
+import json
+import math
+import os
+import queue
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+# 埋め込みの次元数（ハッシュのバケット数、2のべき乗）
+# 1文書あたりの非ゼロ要素は百程度なので4096次元で足りる（float32で1行16KiB）
+# float16にするとクエリとの内積でBLASを使えず、検索ごとに全行のコピーが発生する
+DIM = 2 ** 12
+VECTOR_DTYPE = 'float32'
+INITIAL_CAPACITY = 1024
+
+# バックグラウンドでの追加を待つバッチ数の上限
+INDEX_QUEUE_SIZE = 256
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]{2,}')
+CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u9fff]+')
+
+# インデックスに保持するレコードのフィールド
+RECORD_FIELDS = ['id', 'title', 'authors', 'abstract', 'url', 'publishedDate', 'source']
+
+
+def tokenize(text: str) -> List[str]:
+    """英数字は単語単位、日本語は文字bigramでトークン化"""
+    text = text.lower()
+    tokens = TOKEN_PATTERN.findall(text)
+    for run in CJK_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def hash_features(text: str) -> Dict[int, float]:
+    """トークンをハッシュして符号付きの対数TFベクトル（疎）に変換"""
+    features: Dict[int, float] = {}
+    for token, count in Counter(tokenize(text)).items():
+        h = zlib.crc32(token.encode('utf-8'))
+        bucket = h & (DIM - 1)
+        sign = -1.0 if h & 0x80000000 else 1.0
+        features[bucket] = features.get(bucket, 0.0) + sign * (1.0 + math.log(count))
+    return features
+
+
+def vectorize(texts: List[str]):
+    """テキストを正規化済みの文書ベクトル行列に変換"""
+    import numpy as np
+
+    matrix = np.zeros((len(texts), DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for bucket, value in hash_features(text).items():
+            matrix[row, bucket] = value
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def rank_records(query: str, records: List[Dict], k: int = 10) -> List[Dict]:
+    """インデックスを使わずにレコードをクエリとの類似度で並べ替える"""
+    if not records:
+        return []
+
+    scores = vectorize([record_text(r) for r in records]) @ vectorize([query])[0]
+    order = scores.argsort()[::-1][:k]
+    return [records[i] for i in order if scores[i] > 0]
+
+
+def record_key(record: Dict) -> str:
+    """レコードの重複判定キー（URLがあればURL）"""
+    url = record.get('url', '')
+    if url and url != '#':
+        return url
+    return f"{record.get('source', '')}:{record.get('id', '')}"
+
+
+def record_text(record: Dict) -> str:
+    """埋め込み対象のテキスト"""
+    return f"{record.get('title', '')}\n{record.get('abstract', '')}"
+
+
+class VectorIndex:
+    """
+    ハッシュTF-IDFによるローカル埋め込みインデックス
+
+    文書ベクトルは正規化した対数TFとしてmmap可能な.npyファイル（float32）に保存し、
+    IDFはクエリ側で重み付けする（文書追加でIDFが変わっても既存行を書き換えない）。
+    レコードはJSONLに追記し、件数・JSONLの有効な長さ・文書頻度をstate.npzにまとめて
+    原子的に書き換えることで確定する（確定前に落ちた追記分は次回の追加で切り捨てる）。
+    複数ワーカーはファイルロックで追記を直列化し、同じファイルをmmapで共有する。
+    """
+
+    def __init__(self, directory: str):
+        # 次元数や型を変えたときに古いファイルを読まないようにレイアウトごとに分ける
+        self.directory = os.path.join(directory, f'{DIM}-{VECTOR_DTYPE}')
+        self.vectors_path = os.path.join(self.directory, 'vectors.npy')
+        self.state_path = os.path.join(self.directory, 'state.npz')
+        self.meta_path = os.path.join(self.directory, 'records.jsonl')
+        self.lock_path = os.path.join(self.directory, '.lock')
+
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._df = None
+        self._records: List[Dict] = []
+        self._keys: Dict[str, int] = {}
+        self._offset = 0
+        self._state_version = None
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _file_lock(self):
+        return open(self.lock_path, 'a')
+
+    def _refresh(self) -> None:
+        """他ワーカーによる更新があれば追記されたレコードだけを読み、mmapを開き直す"""
+        import numpy as np
+
+        if not os.path.exists(self.state_path):
+            return
+        stat = os.stat(self.state_path)
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if self._vectors is not None and version == self._state_version:
+            return
+
+        with np.load(self.state_path) as state:
+            count = int(state['count'])
+            offset = int(state['offset'])
+            df = state['df']
+
+        # インデックスが作り直されていれば最初から読む
+        if count < len(self._records):
+            self._records = []
+            self._keys = {}
+            self._offset = 0
+
+        if count > len(self._records):
+            with open(self.meta_path, 'rb') as f:
+                f.seek(self._offset)
+                lines = f.read(offset - self._offset).splitlines()
+            for line in lines:
+                record = json.loads(line)
+                self._keys[record_key(record)] = len(self._records)
+                self._records.append(record)
+
+        self._offset = offset
+        self._vectors = np.load(self.vectors_path, mmap_mode='r')
+        self._df = df
+        self._state_version = version
+
+    def _idf(self):
+        """文書頻度からIDF重みを計算"""
+        import numpy as np
+
+        n = max(len(self._records), 1)
+        return np.log((1 + n) / (1 + self._df)).astype(np.float32) + 1.0
+
+    def add(self, records: List[Dict]) -> int:
+        """新しいレコードを追加（既存のレコードは無視）"""
+        import numpy as np
+
+        if not records:
+            return 0
+
+        with self._lock, self._file_lock() as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+
+                new_records = []
+                seen = set()
+                for record in records:
+                    key = record_key(record)
+                    if key in self._keys or key in seen:
+                        continue
+                    seen.add(key)
+                    new_records.append({f: record.get(f) for f in RECORD_FIELDS})
+
+                if not new_records:
+                    return 0
+
+                matrix = vectorize([record_text(r) for r in new_records])
+                start = len(self._records)
+                end = start + len(new_records)
+
+                # 容量が足りなければ倍々で拡張
+                capacity = self._vectors.shape[0] if self._vectors is not None else 0
+                if end > capacity:
+                    new_capacity = max(INITIAL_CAPACITY, capacity)
+                    while new_capacity < end:
+                        new_capacity *= 2
+                    tmp_path = f'{self.vectors_path}.tmp'
+                    grown = np.lib.format.open_memmap(
+                        tmp_path, mode='w+', dtype=VECTOR_DTYPE, shape=(new_capacity, DIM)
+                    )
+                    if start:
+                        grown[:start] = self._vectors[:start]
+                    grown.flush()
+                    del grown
+                    os.replace(tmp_path, self.vectors_path)
+
+                vectors = np.load(self.vectors_path, mmap_mode='r+')
+                vectors[start:end] = matrix
+                vectors.flush()
+                del vectors
+
+                # 確定済みの位置まで切り詰めてから追記する
+                lines = b''.join(
+                    json.dumps(r, ensure_ascii=False).encode('utf-8') + b'\n' for r in new_records
+                )
+                with open(self.meta_path, 'ab') as f:
+                    f.truncate(self._offset)
+                    f.write(lines)
+
+                df = self._df if self._df is not None else np.zeros(DIM, dtype=np.int64)
+                df = df + (matrix != 0).sum(axis=0)
+
+                # 件数・オフセット・文書頻度を1ファイルで置き換えて追加を確定する
+                tmp_state = f'{self.state_path}.tmp'
+                with open(tmp_state, 'wb') as f:
+                    np.savez(f, count=np.int64(end), offset=np.int64(self._offset + len(lines)), df=df)
+                os.replace(tmp_state, self.state_path)
+
+                # 追記した分だけを読み込む
+                self._vectors = None
+                self._refresh()
+                return len(new_records)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def search(self, texts: List[str], k: int = 10,
+               exclude: Optional[List[Optional[str]]] = None) -> List[List[Dict]]:
+        """複数クエリをまとめてtop-kのコサイン類似度検索"""
+        import numpy as np
+
+        with self._lock:
+            self._refresh()
+            n = len(self._records)
+            if n == 0 or not texts:
+                return [[] for _ in texts]
+
+            idf = self._idf()
+            queries = vectorize(texts) * idf
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            queries /= norms
+
+            scores = queries @ self._vectors[:n].T
+
+            # 自分自身を除外
+            if exclude:
+                for row, key in enumerate(exclude):
+                    if key is not None and key in self._keys:
+                        scores[row, self._keys[key]] = -np.inf
+
+            top = min(k, n)
+            results = []
+            for row in range(len(texts)):
+                candidates = np.argpartition(-scores[row], top - 1)[:top]
+                candidates = candidates[np.argsort(-scores[row][candidates])]
+                results.append([
+                    {**self._records[i], 'score': float(scores[row, i])}
+                    for i in candidates
+                    if np.isfinite(scores[row, i]) and scores[row, i] > 0
+                ])
+            return results
+
+    def related(self, record: Dict, k: int = 10) -> List[Dict]:
+        """レコードに類似するレコードを検索"""
+        return self.search([record_text(record)], k, exclude=[record_key(record)])[0]
+
+    def get(self, key: str) -> Optional[Dict]:
+        """キーからレコードを取得"""
+        with self._lock:
+            self._refresh()
+            index = self._keys.get(key)
+            return self._records[index] if index is not None else None
+
+
+_index: Optional[VectorIndex] = None
+_index_lock = threading.Lock()
+
+# インデックスへの追加待ちのレコード（溢れた分は捨てる。次に取得したときに追加される）
+_index_queue: 'queue.Queue[List[Dict]]' = queue.Queue(maxsize=INDEX_QUEUE_SIZE)
+_indexer: Optional[threading.Thread] = None
+
+
+def get_related_index() -> VectorIndex:
+    """共有のインデックスを取得（初回アクセス時に生成）"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VectorIndex(os.getenv('RELATED_INDEX_DIR', 'related_index'))
+        return _index
+
+
+def _run_indexer() -> None:
+    """キューに溜まったレコードをまとめてインデックスに追加"""
+    while True:
+        records = _index_queue.get()
+        while True:
+            try:
+                records = records + _index_queue.get_nowait()
+            except queue.Empty:
+                break
+
+        try:
+            added = get_related_index().add(records)
+            if added:
+                print(f'Indexed {added} records for related search')
+        except Exception as e:
+            print(f'Error indexing records: {e}')
+
+
+def index_records(records: List[Dict]) -> None:
+    """取得したレコードをバックグラウンドでインデックスに追加（リクエストは待たせない）"""
+    global _indexer
+    if not records:
+        return
+
+    with _index_lock:
+        if _indexer is None:
+            _indexer = threading.Thread(target=_run_indexer, name='related-indexer', daemon=True)
+            _indexer.start()
+
+    try:
+        _index_queue.put_nowait(list(records))
+    except queue.Full:
+        print(f'Index queue is full, skipping {len(records)} records')
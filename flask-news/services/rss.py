@@ -1,18 +1,32 @@
 import concurrent.futures
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-import feedparser
-import requests
+from services.cache import feed_cache
+from services.deadline import Deadline, ensure_deadline
 
 
-def fetch_rss_feed(rss_url: str, source_name: str, category: str = '未分類') -> List[Dict]:
+def fetch_rss_feed(rss_url: str, source_name: str, category: str = '未分類',
+                   deadline: Optional[Deadline] = None) -> List[Dict]:
     """RSSフィードを取得してパース"""
+    cache_key = f'{rss_url}|{source_name}|{category}'
+    cached = feed_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    import feedparser
+    import requests
+    from bs4 import BeautifulSoup
+
+    deadline = ensure_deadline(deadline)
+    if not deadline.check():
+        return []
+
     try:
         response = requests.get(
             rss_url,
             headers={'User-Agent': 'NewsAggregator/1.0'},
-            timeout=10
+            timeout=deadline.timeout(10)
         )
 
         if response.status_code != 200:
@@ -32,7 +46,6 @@ def fetch_rss_feed(rss_url: str, source_name: str, category: str = '未分類')
             # 説明
             description = entry.get('summary', entry.get('description', ''))
             # HTMLタグを削除
-            from bs4 import BeautifulSoup
             description = BeautifulSoup(description, 'html.parser').get_text()
 
             # 公開日
@@ -53,15 +66,18 @@ def fetch_rss_feed(rss_url: str, source_name: str, category: str = '未分類')
                 'category': category
             })
 
+        feed_cache.set(cache_key, articles)
         return articles
 
     except Exception as e:
         print(f'Error fetching {source_name}: {e}')
+        deadline.check()
         return []
 
 
-def fetch_multiple_rss_feeds(sources: List[Dict]) -> List[Dict]:
-    """複数のRSSフィードを並列で取得"""
+def fetch_multiple_rss_feeds(sources: List[Dict], deadline: Optional[Deadline] = None) -> List[Dict]:
+    """複数のRSSフィードを並列で取得（締め切りまでに揃った分だけ返す）"""
+    deadline = ensure_deadline(deadline)
     enabled_sources = [s for s in sources if s.get('enabled', True)]
 
     if not enabled_sources:
@@ -70,23 +86,31 @@ def fetch_multiple_rss_feeds(sources: List[Dict]) -> List[Dict]:
     all_articles = []
 
     # 並列処理で各RSSフィードを取得
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+    try:
         futures = {
             executor.submit(
                 fetch_rss_feed,
                 source['rssUrl'],
                 source['name'],
-                source.get('category', '未分類')
+                source.get('category', '未分類'),
+                deadline
             ): source
             for source in enabled_sources
         }
 
-        for future in concurrent.futures.as_completed(futures):
+        for future in concurrent.futures.as_completed(futures, timeout=deadline.remaining()):
             try:
                 articles = future.result()
                 all_articles.extend(articles)
             except Exception as e:
                 print(f'Error in thread: {e}')
+    except concurrent.futures.TimeoutError:
+        print('Deadline exceeded, returning partial RSS results')
+        deadline.mark_truncated()
+    finally:
+        # 締め切りを過ぎたフィードの完了は待たない
+        executor.shutdown(wait=False, cancel_futures=True)
 
     # 日付でソート（新しい順）
     all_articles.sort(key=lambda x: x.get('publishedDate', ''), reverse=True)
@@ -1,10 +1,29 @@
-from typing import Dict, List
+import hashlib
+import re
+from typing import Dict, List, Optional
 
-import requests
+from services.cache import enrichment_cache
+from services.deadline import Deadline, ensure_deadline
+from services.singleflight import upstream_flight
 
+# 論文ごとのメタデータのうちレコードにマージするもの
+ENRICHMENT_FIELDS = 'citationCount,influentialCitationCount,venue,tldr'
 
-def fetch_semantic_scholar_papers(query: str) -> List[Dict]:
+# Semantic Scholarに未登録の論文は短めの期間だけ記録する（新着論文は後から登録される）
+MISSING_TTL = 60 * 60 * 24
+
+ARXIV_ID_PATTERN = re.compile(r'arxiv\.org/abs/(.+?)(?:v\d+)?$')
+
+
+def fetch_semantic_scholar_papers(query: str, deadline: Optional[Deadline] = None) -> List[Dict]:
     """Semantic Scholar APIから論文を取得"""
+    import requests
+
+    deadline = ensure_deadline(deadline)
+    if not deadline.check():
+        print('Deadline exceeded, skipping Semantic Scholar')
+        return []
+
     url = 'https://api.semanticscholar.org/graph/v1/paper/search'
 
     try:
@@ -16,7 +35,7 @@ def fetch_semantic_scholar_papers(query: str) -> List[Dict]:
                 'fields': 'title,abstract,authors,year,url,tldr'
             },
             headers={'User-Agent': 'NewsAggregator/1.0'},
-            timeout=10
+            timeout=deadline.timeout(10)
         )
 
         if response.status_code != 200:
@@ -45,4 +64,104 @@ def fetch_semantic_scholar_papers(query: str) -> List[Dict]:
 
     except Exception as e:
         print(f'Semantic Scholar API error: {e}')
+        deadline.check()
         return []
+
+
+def arxiv_id_from_url(url: str) -> Optional[str]:
+    """arXivのURLからバージョンなしのIDを取り出す"""
+    match = ARXIV_ID_PATTERN.search(url or '')
+    return match.group(1) if match else None
+
+
+def fetch_enrichment(arxiv_ids: List[str], deadline: Optional[Deadline] = None) -> Optional[Dict[str, Dict]]:
+    """バッチAPIで論文のメタデータを取得してキャッシュ（失敗した場合はNone）"""
+    import requests
+
+    deadline = ensure_deadline(deadline)
+    if not deadline.check():
+        print('Deadline exceeded, skipping Semantic Scholar batch API')
+        return None
+
+    try:
+        print(f'Enriching {len(arxiv_ids)} papers via Semantic Scholar batch API')
+
+        response = requests.post(
+            'https://api.semanticscholar.org/graph/v1/paper/batch',
+            params={'fields': ENRICHMENT_FIELDS},
+            json={'ids': [f'ARXIV:{arxiv_id}' for arxiv_id in arxiv_ids]},
+            headers={'User-Agent': 'NewsAggregator/1.0'},
+            timeout=deadline.timeout(10)
+        )
+
+        if response.status_code != 200:
+            print(f'Semantic Scholar batch API error: {response.status_code}')
+            return None
+
+        # レスポンスはリクエストしたIDと同じ順（見つからない論文はnull）
+        enrichment = {}
+        for arxiv_id, paper in zip(arxiv_ids, response.json()):
+            if paper is None:
+                enrichment_cache.set(arxiv_id, {}, ttl=MISSING_TTL)
+                enrichment[arxiv_id] = {}
+                continue
+
+            fields = {
+                'citationCount': paper.get('citationCount'),
+                'influentialCitationCount': paper.get('influentialCitationCount'),
+                'venue': paper.get('venue') or '',
+                'tldr': (paper.get('tldr') or {}).get('text', ''),
+            }
+            enrichment_cache.set(arxiv_id, fields)
+            enrichment[arxiv_id] = fields
+        return enrichment
+
+    except Exception as e:
+        print(f'Semantic Scholar batch API error: {e}')
+        deadline.check()
+        return None
+
+
+def enrich_arxiv_papers(articles: List[Dict], deadline: Optional[Deadline] = None) -> List[Dict]:
+    """
+    arXivの論文にSemantic Scholarの被引用数・掲載先・TLDRをマージ
+
+    キャッシュにない論文だけをバッチAPIで1回のリクエストにまとめて取得する。
+    取得に失敗した場合は元のレコードをそのまま返し、結果をキャッシュさせないように
+    deadlineのtruncatedを立てる。
+    """
+    deadline = ensure_deadline(deadline)
+
+    ids = [arxiv_id_from_url(article.get('url', '')) for article in articles]
+    enrichment = {}
+    missing = set()
+    for arxiv_id in ids:
+        if arxiv_id is None or arxiv_id in enrichment:
+            continue
+        cached = enrichment_cache.get(arxiv_id)
+        if cached is not None:
+            enrichment[arxiv_id] = cached
+        else:
+            missing.add(arxiv_id)
+
+    if missing:
+        # 同じ論文の組に対する同時リクエストは1回のバッチ呼び出しにまとめる
+        missing_ids = sorted(missing)
+        digest = hashlib.sha1(','.join(missing_ids).encode('utf-8')).hexdigest()
+        fetched = upstream_flight.do_with_deadline(
+            f'semantic-scholar-batch:{digest}',
+            fetch_enrichment,
+            missing_ids,
+            deadline=deadline,
+            default=None
+        )
+        if fetched is None:
+            deadline.mark_truncated()
+        else:
+            enrichment.update(fetched)
+
+    # 共有されている元のレコードは変更せずにコピーへマージする
+    return [
+        {**article, **enrichment[arxiv_id]} if enrichment.get(arxiv_id) else article
+        for article, arxiv_id in zip(articles, ids)
+    ]
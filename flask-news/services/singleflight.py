@@ -0,0 +1,138 @@
+import concurrent.futures
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from services.deadline import Deadline, max_timeout
+
+
+def max_flights() -> int:
+    """同時に実行する上流呼び出し（キー）の数の上限"""
+    return int(os.getenv('UPSTREAM_MAX_FLIGHTS', 16))
+
+
+class _Flight:
+    """実行中の上流呼び出しと、その結果を待っている呼び出し元の数"""
+
+    def __init__(self, future: concurrent.futures.Future, deadline: Optional[Deadline] = None):
+        self.future = future
+        self.deadline = deadline
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    同一キーの同時呼び出しを1回の上流呼び出しにまとめる
+
+    上流呼び出しはリクエスト処理とは別のスレッドプールで実行する。プールの大きさと
+    同時に実行する呼び出しの数をUPSTREAM_MAX_FLIGHTSで揃えるので、別のクエリの後ろで
+    待たされることはなく、上限に達したときは合流させずに呼び出し元のスレッドで実行する。
+    待っている呼び出し元が全員離脱した呼び出しは締め切りを切って早めに打ち切る。
+    """
+
+    def __init__(self, max_flights: Optional[int] = None):
+        self._max_flights = max_flights
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._pool_size = 0
+        self._running = 0
+        self._calls: Dict[str, _Flight] = {}
+        self._lock = threading.RLock()
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            self._running -= 1
+            if self._calls.get(key) is flight:
+                del self._calls[key]
+
+    def _join(self, key: str, fn: Callable[[], Any],
+              deadline: Optional[Deadline] = None) -> Optional[_Flight]:
+        """実行中の同一キーの呼び出しに合流するか新しく開始（上限に達していればNone）"""
+        with self._lock:
+            flight = self._calls.get(key)
+            if flight is not None:
+                print(f'Joining in-flight upstream call: {key}')
+            else:
+                if self._executor is None:
+                    self._pool_size = self._max_flights or max_flights()
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self._pool_size, thread_name_prefix='singleflight'
+                    )
+                if self._running >= self._pool_size:
+                    return None
+
+                flight = _Flight(self._executor.submit(fn), deadline)
+                self._running += 1
+                self._calls[key] = flight
+                flight.future.add_done_callback(lambda f: self._finish(key, flight))
+
+            flight.waiters += 1
+            return flight
+
+    def _leave(self, key: str, flight: _Flight) -> None:
+        """待機を終了（最後の呼び出し元が結果を待たずに離脱したら打ち切る）"""
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters > 0 or flight.future.done():
+                return
+            # 以降の呼び出し元は打ち切った呼び出しに合流させない
+            if self._calls.get(key) is flight:
+                del self._calls[key]
+
+        print(f'Abandoning upstream call with no waiters: {key}')
+        if flight.deadline is not None:
+            flight.deadline.cancel()
+
+    def do(self, key: str, fn: Callable[..., Any], *args,
+           timeout: Optional[float] = None, **kwargs) -> Any:
+        """実行中の同一キーの呼び出しがあればその結果を待ち、なければ実行する"""
+        flight = self._join(key, lambda: fn(*args, **kwargs))
+        if flight is None:
+            print(f'Too many in-flight upstream calls, calling directly: {key}')
+            return fn(*args, **kwargs)
+
+        try:
+            return flight.future.result(timeout=timeout)
+        finally:
+            self._leave(key, flight)
+
+    def do_with_deadline(self, key: str, fn: Callable[..., Any], *args,
+                         deadline: Deadline, default: Any = None, **kwargs) -> Any:
+        """
+        締め切り付きでdoを実行
+
+        共有される呼び出しは特定の呼び出し元ではなくREQUEST_TIMEOUT_MAXの締め切りで
+        実行し、各呼び出し元は自分の残り時間だけ待つ。間に合わなければdefaultを返して
+        truncatedを立てる。上限に達していれば呼び出し元の締め切りで直接実行する。
+        """
+        shared = Deadline.after(max_timeout())
+
+        def call():
+            result = fn(*args, deadline=shared, **kwargs)
+            return result, shared.truncated
+
+        flight = self._join(key, call, shared)
+        if flight is None:
+            print(f'Too many in-flight upstream calls, calling directly: {key}')
+            return fn(*args, deadline=deadline, **kwargs)
+
+        try:
+            result, truncated = flight.future.result(timeout=deadline.remaining())
+        except concurrent.futures.TimeoutError:
+            print(f'Deadline exceeded while waiting for upstream call: {key}')
+            deadline.mark_truncated()
+            return default
+        finally:
+            self._leave(key, flight)
+
+        if truncated:
+            deadline.mark_truncated()
+        return result
+
+
+def normalize_query(query: str) -> str:
+    """キャッシュ・集約用にクエリを正規化（大文字小文字と空白の揺れを吸収）"""
+    return ' '.join(query.lower().split())
+
+
+# 上流API呼び出しで共有するインスタンス
+upstream_flight = SingleFlight()
@@ -368,15 +368,25 @@ function createArticleCard(article, index, isPatent = false) {
                 ${categoryInfo}
             </div>
             <p class="article-abstract">${article.abstract}</p>
-            <div id="summary-${index}"></div>
+            <div id="summary-${index}">${article.summary ? renderSummary(article.summary) : ''}</div>
             <div class="article-actions">
                 <a href="${article.url}" target="_blank">詳細を見る</a>
-                <button onclick="summarizeArticle(${index})">AI要約を生成</button>
+                ${article.summary ? '' : `<button onclick="summarizeArticle(${index})">AI要約を生成</button>`}
             </div>
         </div>
     `;
 }
 
+// 要約の表示（ダイジェストで事前計算された要約にも使う）
+function renderSummary(summary) {
+    return `
+        <div class="article-summary">
+            <h4>AI要約:</h4>
+            <p>${summary}</p>
+        </div>
+    `;
+}
+
 async function summarizeArticle(index) {
     const article = articles[index];
     const summaryDiv = document.getElementById(`summary-${index}`);
@@ -398,13 +408,12 @@ async function summarizeArticle(index) {
         const data = await response.json();
 
         if (response.ok) {
-            summaryDiv.innerHTML = `
-                <div class="article-summary">
-                    <h4>AI要約:</h4>
-                    <p>${data.summary}</p>
-                </div>
-            `;
+            summaryDiv.innerHTML = renderSummary(data.summary);
             button.style.display = 'none';
+        } else if (response.status === 429) {
+            alert(data.error || '要約リクエストが混雑しています');
+            button.disabled = false;
+            button.textContent = 'AI要約を生成';
         } else {
             alert('要約の生成に失敗しました');
             button.disabled = false;